@@ -6,45 +6,89 @@ Automatically adds watermarks to photos and videos in the INPUT folder.
 
 import os
 import sys
+import atexit
 import json
 import logging
+import logging.handlers
+import multiprocessing
+import functools
+import shlex
 import shutil
 import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from threading import Lock
+from threading import Event, Lock, Thread
+from types import SimpleNamespace
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from PIL import Image, ImageDraw, ImageFont
+import PIL
+from PIL import Image, ImageDraw, ImageFont, features
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('watermark_app.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Queue feeding the log listener, shared with the worker processes
+log_queue = None
+
+# FFmpeg resolved once so each run skips the PATH search; the bare name is
+# kept as a fallback so a missing binary still raises FileNotFoundError
+FFMPEG = shutil.which('ffmpeg') or 'ffmpeg'
+
+# Hardware H.264 encoders in order of preference
+HW_ENCODERS = ['h264_nvenc', 'h264_qsv', 'h264_videotoolbox', 'h264_amf']
+
+# Constant-quality settings for hardware encoders that would otherwise fall
+# back to FFmpeg's 200 kb/s default bitrate, roughly matching libx264 CRF 23
+HW_QUALITY_ARGS = {
+    'h264_qsv': ['-global_quality', '23'],
+    'h264_videotoolbox': ['-q:v', '65'],
+    'h264_amf': ['-rc', 'cqp', '-qp_i', '23', '-qp_p', '23'],
+}
+
+# Containers that can hold H.264; others (WebM) keep FFmpeg's default codec
+H264_CONTAINERS = frozenset({'.mp4', '.mov', '.mkv', '.avi'})
+
+# Optimized Huffman tables and progressive scans make smaller JPEGs
+JPEG_SAVE_OPTIONS = {'quality': 95, 'optimize': True, 'progressive': True}
+
+# Number of existing videos watermarked by a single FFmpeg run
+VIDEO_BATCH_SIZE = 4
+
 class WatermarkProcessor:
     def __init__(self, config_path='config.json'):
         """Initialize the watermark processor with configuration."""
         self.config = self.load_config(config_path)
+        self.image_formats = frozenset(ext.lower() for ext in self.config['supported_formats']['images'])
+        self.video_formats = frozenset(ext.lower() for ext in self.config['supported_formats']['videos'])
         self.processing_lock = Lock()
         self.setup_directories()
+        self.hw_encoder = self._detect_hw_encoder()
+        
+        # The watermark is identical for every file, so resolve the font
+        # and text layout once up front
+        self.watermark = self.load_watermark_settings()
+        self.font = self.get_default_font(self.watermark.font_size)
+        self.layout = self.measure_watermark()
+        self.watermark_tile = self.render_watermark()
+        self.watermark_png = self.create_watermark_overlay()
+        
+        # The FFmpeg arguments only depend on the configuration, so only the
+        # input and output paths vary between runs
+        self.video_codec_args = self.get_video_codec_args()
+        self.overlay_filter = self.get_overlay_filter()
         
     def load_config(self, config_path):
         """Load configuration from JSON file."""
         try:
-            with open(config_path, 'r') as f:
-                return json.load(f)
+            # json.loads detects the encoding itself, so skip the text layer
+            with open(config_path, 'rb') as f:
+                return json.loads(f.read())
         except FileNotFoundError:
-            logger.error(f"Configuration file {config_path} not found")
+            logger.error("Configuration file %s not found", config_path)
             sys.exit(1)
         except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON in configuration file: {e}")
+            logger.error("Invalid JSON in configuration file: %s", e)
             sys.exit(1)
     
     def setup_directories(self):
@@ -55,29 +99,110 @@ class WatermarkProcessor:
         input_dir.mkdir(exist_ok=True)
         output_dir.mkdir(exist_ok=True)
         
-        logger.info(f"Input directory: {input_dir.absolute()}")
-        logger.info(f"Output directory: {output_dir.absolute()}")
+        # Partial files left by an interrupted run would block their inputs
+        # from ever being processed again
+        for partial_path in output_dir.glob('.*.partial.*'):
+            logger.warning("Removing leftover partial output: %s", partial_path)
+            partial_path.unlink(missing_ok=True)
+        
+        logger.info("Input directory: %s", input_dir.absolute())
+        logger.info("Output directory: %s", output_dir.absolute())
     
-    def is_supported_file(self, file_path):
-        """Check if file is a supported format."""
-        suffix = Path(file_path).suffix.lower()
-        supported = (
-            self.config['supported_formats']['images'] + 
-            self.config['supported_formats']['videos']
-        )
-        return suffix in supported
+    def _detect_hw_encoder(self):
+        """Find a hardware H.264 encoder that FFmpeg can actually use."""
+        requested = self.config.get('ffmpeg', {}).get('hw_encoder', 'auto')
+        if requested != 'auto':
+            # An explicit encoder, or null to disable, skips detection
+            if requested:
+                logger.info("Using configured video encoder: %s", requested)
+            return requested or None
+        
+        try:
+            result = subprocess.run(
+                [FFMPEG, '-hide_banner', '-loglevel', 'error', '-encoders'],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                timeout=10
+            )
+        except (subprocess.SubprocessError, FileNotFoundError):
+            return None
+        
+        for encoder in HW_ENCODERS:
+            if encoder not in result.stdout:
+                continue
+            
+            # Builds often list encoders whose device is missing, so try a
+            # one-frame encode before committing to it
+            probe = [
+                FFMPEG, '-hide_banner', '-loglevel', 'error',
+                '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+                '-frames:v', '1',
+                # Probe with the real settings; not every device supports
+                # the constant-quality modes
+                *self.get_hw_encoder_args(encoder),
+                '-f', 'null', '-'
+            ]
+            try:
+                result = subprocess.run(
+                    probe,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=30
+                )
+                if result.returncode == 0:
+                    logger.info("Using hardware video encoder: %s", encoder)
+                    return encoder
+            except subprocess.SubprocessError:
+                continue
+        
+        logger.info("No hardware video encoder available, using software encoding")
+        return None
     
-    def is_image_file(self, file_path):
-        """Check if file is a supported image format."""
-        suffix = Path(file_path).suffix.lower()
-        return suffix in self.config['supported_formats']['images']
+    def get_hw_encoder_args(self, encoder):
+        """Build the FFmpeg arguments for a hardware H.264 encoder."""
+        if encoder == 'h264_nvenc':
+            # -b:v 0 lifts the default bitrate cap so -cq alone sets quality
+            return [
+                '-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'hq',
+                '-rc', 'vbr', '-cq', '23', '-b:v', '0'
+            ]
+        
+        bitrate = self.config.get('ffmpeg', {}).get('bitrate')
+        if bitrate:
+            return ['-c:v', encoder, '-b:v', bitrate]
+        return ['-c:v', encoder, *HW_QUALITY_ARGS.get(encoder, [])]
     
-    def is_video_file(self, file_path):
-        """Check if file is a supported video format."""
-        suffix = Path(file_path).suffix.lower()
-        return suffix in self.config['supported_formats']['videos']
+    def get_video_codec_args(self):
+        """Build the FFmpeg H.264 encoder arguments."""
+        if self.hw_encoder:
+            return self.get_hw_encoder_args(self.hw_encoder)
+        
+        ffmpeg_config = self.config.get('ffmpeg', {})
+        return [
+            '-c:v', ffmpeg_config.get('video_codec', 'libx264'),
+            '-preset', ffmpeg_config.get('preset', 'medium')
+        ]
+    
+    def get_overlay_filter(self):
+        """Build the FFmpeg overlay filter placing the watermark like on images."""
+        margin = self.watermark.margin
+        box_width, box_height = self.layout['box_size']
+        return f"overlay=x=main_w-{box_width}-{margin}:y=main_h-{box_height}-{margin}"
     
-    def get_default_font(self, size):
+    def get_media_type(self, file_path):
+        """Classify a file as 'image' or 'video', or None if unsupported."""
+        suffix = os.path.splitext(file_path)[1].lower()
+        if suffix in self.image_formats:
+            return 'image'
+        if suffix in self.video_formats:
+            return 'video'
+        return None
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def get_default_font(size):
         """Get a default font for the system."""
         try:
             # Try to use a common system font
@@ -92,206 +217,234 @@ class WatermarkProcessor:
                     # Fall back to default font
                     return ImageFont.load_default()
     
+    def load_watermark_settings(self):
+        """Flatten the watermark configuration used for every file."""
+        watermark_config = self.config['watermark']
+        
+        font_color = watermark_config['font_color']
+        if len(font_color) == 3:
+            # Use 70% opacity (179 = 70% of 255)
+            font_color = font_color + [179]
+        bg_color = watermark_config.get('background_color')
+        
+        return SimpleNamespace(
+            lines=watermark_config['text'].split('\n'),
+            font_size=watermark_config['font_size'],
+            font_color=tuple(font_color),
+            bg_color=tuple(bg_color) if bg_color is not None else None,
+            padding=watermark_config['padding'],
+            margin=watermark_config['margin']
+        )
+    
+    def measure_watermark(self):
+        """Measure the watermark text and the box it is positioned by."""
+        draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+        
+        # Offset of the text inside the box when a background is drawn
+        offset = self.watermark.padding if self.watermark.bg_color is not None else 0
+        
+        line_heights = []
+        line_widths = []
+        ink_right = 0
+        ink_bottom = 0
+        current_y = offset
+        
+        for line in self.watermark.lines:
+            bbox = draw.textbbox((0, 0), line, font=self.font)
+            line_widths.append(bbox[2] - bbox[0])
+            line_heights.append(bbox[3] - bbox[1])
+            # Glyphs are drawn below their origin by the bbox offset, so
+            # track how far the ink actually reaches
+            ink_right = max(ink_right, offset + bbox[2])
+            ink_bottom = max(ink_bottom, current_y + bbox[3])
+            current_y += line_heights[-1] + 5
+        
+        text_width = max(line_widths)
+        text_height = sum(line_heights) + (len(line_heights) - 1) * 5  # 5px line spacing
+        box_width = text_width + 2 * offset
+        box_height = text_height + 2 * offset
+        
+        return {
+            'line_heights': line_heights,
+            'box_size': (box_width, box_height),
+            # Room for the inclusive background rectangle and overhanging ink
+            'canvas_size': (max(box_width + 1, ink_right), max(box_height + 1, ink_bottom))
+        }
+    
+    def draw_watermark(self, draw, origin):
+        """Draw the watermark box with its top-left corner at origin."""
+        x, y = origin
+        
+        # Draw background rectangle only if background color is specified
+        if self.watermark.bg_color is not None:
+            box_width, box_height = self.layout['box_size']
+            draw.rectangle(
+                [x, y, x + box_width, y + box_height],
+                fill=self.watermark.bg_color
+            )
+            # Adjust text position when background is present
+            x += self.watermark.padding
+            y += self.watermark.padding
+        
+        # Draw text lines
+        current_y = y
+        for i, line in enumerate(self.watermark.lines):
+            draw.text(
+                (x, current_y),
+                line,
+                fill=self.watermark.font_color,
+                font=self.font
+            )
+            current_y += self.layout['line_heights'][i] + 5
+    
+    def render_watermark(self):
+        """Render the watermark once onto a transparent tile."""
+        tile = Image.new('RGBA', self.layout['canvas_size'], (0, 0, 0, 0))
+        self.draw_watermark(ImageDraw.Draw(tile), (0, 0))
+        return tile
+    
+    def create_watermark_overlay(self):
+        """Save the watermark tile to a temporary PNG for video overlays."""
+        with tempfile.NamedTemporaryFile(prefix='watermark_', suffix='.png', delete=False) as f:
+            self.watermark_tile.save(f, format='PNG')
+        atexit.register(Path(f.name).unlink, missing_ok=True)
+        
+        return f.name
+    
     def add_watermark_to_image(self, input_path, output_path):
         """Add watermark to an image file."""
         try:
             # Open the image
             with Image.open(input_path) as img:
-                # Convert to RGBA if not already
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                # Create a transparent overlay
-                overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
-                draw = ImageDraw.Draw(overlay)
+                original_mode = img.mode
                 
-                # Get watermark configuration
-                watermark_config = self.config['watermark']
-                text = watermark_config['text']
-                font_size = watermark_config['font_size']
-                # Use 70% opacity (179 = 70% of 255)
-                font_color = tuple(watermark_config['font_color'] + [179])
-                bg_color = watermark_config.get('background_color')
-                padding = watermark_config['padding']
-                margin = watermark_config['margin']
-                
-                # Get font
-                font = self.get_default_font(font_size)
-                
-                # Calculate text size
-                lines = text.split('\n')
-                line_heights = []
-                line_widths = []
-                
-                for line in lines:
-                    bbox = draw.textbbox((0, 0), line, font=font)
-                    line_widths.append(bbox[2] - bbox[0])
-                    line_heights.append(bbox[3] - bbox[1])
-                
-                text_width = max(line_widths)
-                text_height = sum(line_heights) + (len(lines) - 1) * 5  # 5px line spacing
+                # RGB images take the watermark directly; other modes are
+                # blended in RGBA
+                if img.mode not in ('RGB', 'RGBA'):
+                    img = img.convert('RGBA')
                 
                 # Calculate watermark position (bottom-right)
-                # Position text directly without background padding
-                x = img.width - text_width - margin
-                y = img.height - text_height - margin
-                
-                # Draw background rectangle only if background color is specified
-                if bg_color is not None:
-                    watermark_width = text_width + 2 * padding
-                    watermark_height = text_height + 2 * padding
-                    bg_x = img.width - watermark_width - margin
-                    bg_y = img.height - watermark_height - margin
-                    
-                    draw.rectangle(
-                        [bg_x, bg_y, bg_x + watermark_width, bg_y + watermark_height],
-                        fill=tuple(bg_color)
-                    )
-                    # Adjust text position when background is present
-                    x = bg_x + padding
-                    y = bg_y + padding
+                box_width, box_height = self.layout['box_size']
+                x = img.width - box_width - self.watermark.margin
+                y = img.height - box_height - self.watermark.margin
                 
-                # Draw text lines
-                current_y = y
-                for i, line in enumerate(lines):
-                    draw.text(
-                        (x, current_y),
-                        line,
-                        fill=font_color,
-                        font=font
-                    )
-                    current_y += line_heights[i] + 5
-                
-                # Composite the overlay onto the original image
-                watermarked = Image.alpha_composite(img, overlay)
+                tile = self.watermark_tile
+                if img.mode == 'RGB':
+                    # On an opaque image, pasting through the tile's alpha
+                    # gives exactly the alpha-composited pixels
+                    img.paste(tile, (x, y), tile)
+                else:
+                    # Composite just the watermark region and paste it back;
+                    # the rest of the image would only meet transparent pixels
+                    box = (x, y, x + tile.width, y + tile.height)
+                    img.paste(Image.alpha_composite(img.crop(box), tile), box[:2])
+                watermarked = img
                 
                 # Convert back to RGB if original was not RGBA
-                if Image.open(input_path).mode != 'RGBA':
+                if original_mode != 'RGBA' and watermarked.mode != 'RGB':
                     watermarked = watermarked.convert('RGB')
                 
                 # Save the watermarked image
-                watermarked.save(output_path, quality=95)
-                logger.info(f"Successfully watermarked image: {input_path} -> {output_path}")
+                if Path(output_path).suffix.lower() in ('.jpg', '.jpeg'):
+                    save_options = JPEG_SAVE_OPTIONS
+                else:
+                    save_options = {'quality': 95}
+                watermarked.save(output_path, **save_options)
                 
         except Exception as e:
-            logger.error(f"Error watermarking image {input_path}: {e}")
+            logger.error("Error watermarking image %s: %s", input_path, e)
             raise
     
-    def escape_text_for_ffmpeg(self, text):
-        """Properly escape text for FFmpeg drawtext filter."""
-        # Replace newlines with literal \n for FFmpeg
-        escaped_text = text.replace('\n', '\\n')
-        
-        # Escape colons which are parameter separators in FFmpeg
-        escaped_text = escaped_text.replace(':', '\\:')
-        
-        # Escape other special characters that might cause issues
-        escaped_text = escaped_text.replace("'", "\\'")
-        escaped_text = escaped_text.replace('"', '\\"')
-        escaped_text = escaped_text.replace('=', '\\=')
-        escaped_text = escaped_text.replace('[', '\\[')
-        escaped_text = escaped_text.replace(']', '\\]')
-        
-        return escaped_text
-    
     def add_watermark_to_video(self, input_path, output_path):
         """Add watermark to a video file using FFmpeg."""
         try:
-            # Prepare watermark text for FFmpeg
-            watermark_config = self.config['watermark']
-            raw_text = watermark_config['text']
-            font_size = watermark_config['font_size']
-            margin = watermark_config['margin']
-            
-            # Try multiple escape strategies for maximum compatibility
-            escape_strategies = [
-                {
-                    'name': 'Standard escaping',
-                    'text': self.escape_text_for_ffmpeg(raw_text)
-                },
-                {
-                    'name': 'Simple escaping (fallback)',
-                    'text': raw_text.replace('\n', '\\\\n').replace(':', '\\:')
-                },
-                {
-                    'name': 'Basic replacement (last resort)',
-                    'text': raw_text.replace('\n', ' | ').replace(':', ' ')
-                }
-            ]
-            
-            last_error = None
-            for strategy in escape_strategies:
-                try:
-                    escaped_text = strategy['text']
-                    logger.info(f"Trying watermark strategy: {strategy['name']}")
-                    logger.debug(f"Escaped text: {repr(escaped_text)}")
-                    
-                    # Build FFmpeg command
-                    # Use a more robust filter string construction
-                    filter_parts = [
-                        f"text={escaped_text}",
-                        f"fontsize={font_size}",
-                        "fontcolor=black@0.7",
-                        f"x=w-tw-{margin}",
-                        f"y=h-th-{margin}"
-                    ]
-                    filter_string = "drawtext=" + ":".join(filter_parts)
-                    
-                    cmd = [
-                        'ffmpeg',
-                        '-i', str(input_path),
-                        '-vf', filter_string,
-                        '-c:a', 'copy',  # Copy audio without re-encoding
-                        '-y',  # Overwrite output file
-                        str(output_path)
-                    ]
-                    
-                    logger.debug(f"FFmpeg command: {' '.join(cmd)}")
-                    
-                    # Run FFmpeg
-                    result = subprocess.run(
-                        cmd,
-                        capture_output=True,
-                        text=True,
-                        timeout=300  # 5 minute timeout
-                    )
-                    
-                    if result.returncode == 0:
-                        logger.info(f"Successfully watermarked video using {strategy['name']}: {input_path} -> {output_path}")
-                        return
-                    else:
-                        last_error = result.stderr
-                        logger.warning(f"Strategy '{strategy['name']}' failed: {result.stderr}")
-                        continue
-                        
-                except subprocess.TimeoutExpired as e:
-                    last_error = f"Timeout with strategy '{strategy['name']}'"
-                    logger.warning(last_error)
-                    continue
-                except Exception as e:
-                    last_error = f"Exception with strategy '{strategy['name']}': {e}"
-                    logger.warning(last_error)
-                    continue
-            
-            # If all strategies failed, raise the last error
-            logger.error(f"All watermarking strategies failed. Last error: {last_error}")
-            raise subprocess.CalledProcessError(1, "ffmpeg", last_error)
-                
+            self.add_watermark_to_videos([(input_path, output_path)])
         except Exception as e:
-            logger.error(f"Error watermarking video {input_path}: {e}")
+            # FFmpeg's own message says what is wrong with the file
+            detail = e.stderr if isinstance(e, subprocess.CalledProcessError) else e
+            logger.error("Error watermarking video %s: %s", input_path, detail)
             raise
     
-    def process_file(self, input_path):
-        """Process a single file by adding watermark."""
-        input_path = Path(input_path)
+    def add_watermark_to_videos(self, jobs):
+        """Add watermark to several videos with a single FFmpeg run.
+        
+        jobs is a list of (input_path, output_path) pairs. Sharing one
+        process pays FFmpeg startup and encoder initialization once.
+        Failures are raised without logging, as a failed batch is
+        retried video by video.
+        """
+        # Temp cleaners can delete the overlay while the watcher runs for
+        # days, so put it back from the tile if it has gone
+        if not os.path.exists(self.watermark_png):
+            logger.warning("Watermark overlay missing, recreating: %s", self.watermark_png)
+            self.watermark_tile.save(self.watermark_png, format='PNG')
         
+        cmd = [
+            FFMPEG,
+            '-y',  # Overwrite output files
+            # Only report errors; progress lines for a long encode would
+            # otherwise pile up in the captured stderr
+            '-hide_banner', '-nostats', '-loglevel', 'error'
+        ]
+        for input_path, _ in jobs:
+            # Decode on the GPU when possible; frames are copied back
+            # to system memory for the overlay filter
+            cmd += ['-hwaccel', 'auto', '-i', str(input_path)]
+        cmd += ['-i', self.watermark_png]
+        
+        # The watermark input can only be consumed once, so split it
+        # into a copy per video
+        watermark_input = len(jobs)
+        filter_graph = [
+            f"[{watermark_input}:v]split={len(jobs)}"
+            + "".join(f"[wm{i}]" for i in range(len(jobs)))
+        ]
+        filter_graph += [f"[{i}:v][wm{i}]{self.overlay_filter}[v{i}]" for i in range(len(jobs))]
+        cmd += ['-filter_complex', ';'.join(filter_graph)]
+        
+        for i, (_, output_path) in enumerate(jobs):
+            if Path(output_path).suffix.lower() in H264_CONTAINERS:
+                codec_args = self.video_codec_args
+            else:
+                codec_args = []
+            cmd += [
+                '-map', f'[v{i}]',
+                '-map', f'{i}:a?',
+                *codec_args,
+                '-c:a', 'copy',  # Copy audio without re-encoding
+                str(output_path)
+            ]
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            # Quoted so the command can be pasted into a shell
+            logger.debug("FFmpeg command: %s", shlex.join(cmd))
+        
+        # Run FFmpeg
+        # FFmpeg writes nothing useful to stdout, and stderr is only
+        # decoded when there is an error to report. FFmpeg also polls
+        # stdin for keyboard commands, which would swallow keystrokes
+        # from the terminal, so give it no stdin at all
+        result = subprocess.run(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            timeout=300 * len(jobs)  # 5 minutes per video
+        )
+        
+        if result.returncode != 0:
+            stderr = result.stderr.decode('utf-8', 'replace')
+            raise subprocess.CalledProcessError(result.returncode, cmd, stderr=stderr)
+    
+    def get_output_path(self, input_path, media_type):
+        """Get the output path for a file, or None if it should be skipped."""
         if not input_path.exists():
-            logger.warning(f"File does not exist: {input_path}")
-            return
+            logger.warning("File does not exist: %s", input_path)
+            return None
         
-        if not self.is_supported_file(input_path):
-            logger.warning(f"Unsupported file format: {input_path}")
-            return
+        if media_type is None:
+            logger.warning("Unsupported file format: %s", input_path)
+            return None
         
         # Generate output path
         output_dir = Path(self.config['folders']['output'])
@@ -299,73 +452,313 @@ class WatermarkProcessor:
         
         # Avoid processing the same file multiple times
         if output_path.exists():
-            logger.info(f"Output file already exists, skipping: {output_path}")
+            logger.info("Output file already exists, skipping: %s", output_path)
+            return None
+        
+        return output_path
+    
+    def reserve_output(self, input_path, output_path):
+        """Atomically claim an output file.
+        
+        Returns the partial path to write to before it is renamed into
+        place, or None if another thread or process already claimed it
+        or it can't be created.
+        """
+        # Keep the suffix so Pillow and FFmpeg still pick the right format
+        partial_path = output_path.with_name(f".{output_path.stem}.partial{output_path.suffix}")
+        try:
+            os.close(os.open(partial_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+        except FileExistsError:
+            logger.info("File is already being processed, skipping: %s", output_path)
+            return None
+        except OSError as e:
+            # e.g. the partial name is too long, or the disk is full
+            logger.error("Failed to process file %s: %s", input_path, e)
+            return None
+        
+        # Another worker may have finished between the existence check and
+        # the reservation
+        if output_path.exists():
+            partial_path.unlink()
+            logger.info("Output file already exists, skipping: %s", output_path)
+            return None
+        
+        return partial_path
+    
+    def process_file(self, input_path):
+        """Process a single file by adding watermark."""
+        input_path = Path(input_path)
+        media_type = self.get_media_type(input_path)
+        output_path = self.get_output_path(input_path, media_type)
+        if output_path is None:
             return
         
-        with self.processing_lock:
+        partial_path = self.reserve_output(input_path, output_path)
+        if partial_path is None:
+            return
+        
+        try:
+            logger.info("Processing file: %s", input_path)
+            
+            if media_type == 'image':
+                self.add_watermark_to_image(input_path, partial_path)
+            elif media_type == 'video':
+                # FFmpeg already uses every core (or the GPU encoder), so
+                # only one video is encoded at a time
+                with self.processing_lock:
+                    self.add_watermark_to_video(input_path, partial_path)
+            
+            os.replace(partial_path, output_path)
+            logger.info("File processed successfully: %s", output_path)
+            
+        except Exception as e:
+            logger.error("Failed to process file %s: %s", input_path, e)
+            # Clean up partial output file if it exists
             try:
-                logger.info(f"Processing file: {input_path}")
-                
-                if self.is_image_file(input_path):
-                    self.add_watermark_to_image(input_path, output_path)
-                elif self.is_video_file(input_path):
-                    self.add_watermark_to_video(input_path, output_path)
-                
-                logger.info(f"File processed successfully: {output_path}")
-                
-            except Exception as e:
-                logger.error(f"Failed to process file {input_path}: {e}")
-                # Clean up partial output file if it exists
-                if output_path.exists():
-                    try:
-                        output_path.unlink()
-                    except:
-                        pass
+                partial_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+    
+    def process_video_batch(self, input_paths):
+        """Process several videos with a single FFmpeg run."""
+        jobs = []
+        for input_path in input_paths:
+            input_path = Path(input_path)
+            output_path = self.get_output_path(input_path, 'video')
+            if output_path is None:
+                continue
+            partial_path = self.reserve_output(input_path, output_path)
+            if partial_path is not None:
+                jobs.append((input_path, partial_path, output_path))
+        
+        if len(jobs) > 1:
+            with self.processing_lock:
+                try:
+                    logger.info("Processing %d videos in one FFmpeg run", len(jobs))
+                    self.add_watermark_to_videos([(input_path, partial_path) for input_path, partial_path, _ in jobs])
+                    for _, partial_path, output_path in jobs:
+                        os.replace(partial_path, output_path)
+                        logger.info("File processed successfully: %s", output_path)
+                    return
+                except Exception as e:
+                    # One bad input fails the whole run, so retry each
+                    # video on its own
+                    detail = e.stderr if isinstance(e, subprocess.CalledProcessError) else e
+                    logger.warning("Batched video processing failed, retrying individually: %s", detail)
+        
+        # Release the reservations so each video can be claimed on its own
+        for input_path, partial_path, _ in jobs:
+            partial_path.unlink(missing_ok=True)
+            self.process_file(input_path)
     
     def process_existing_files(self):
         """Process any existing files in the INPUT directory."""
         input_dir = Path(self.config['folders']['input'])
         
-        for file_path in input_dir.iterdir():
-            if file_path.is_file() and self.is_supported_file(file_path):
-                self.process_file(file_path)
+        images = []
+        videos = []
+        # scandir answers is_file() from the directory listing itself
+        # instead of a stat() per entry
+        with os.scandir(input_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                media_type = self.get_media_type(entry.name)
+                if media_type == 'image':
+                    images.append(Path(entry.path))
+                elif media_type == 'video':
+                    videos.append(Path(entry.path))
+        
+        # Image watermarking is CPU-bound and independent per file, so spread
+        # the backlog across processes
+        executor = None
+        if images:
+            executor = ProcessPoolExecutor(
+                max_workers=min(len(images), os.cpu_count() or 1),
+                initializer=_init_worker,
+                initargs=(self, log_queue)
+            )
+            image_results = executor.map(_process_file_in_worker, images)
+        
+        try:
+            # Encode videos while the workers get through the images
+            for i in range(0, len(videos), VIDEO_BATCH_SIZE):
+                self.process_video_batch(videos[i:i + VIDEO_BATCH_SIZE])
+            
+            if executor is not None:
+                list(image_results)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    
+    def __getstate__(self):
+        """Drop the lock and font, which can't be sent to worker processes.
+        
+        Workers only paste the pre-rendered tile, so they never need the font.
+        """
+        state = self.__dict__.copy()
+        del state['processing_lock']
+        del state['font']
+        return state
+    
+    def __setstate__(self, state):
+        """Recreate the lock in a worker process."""
+        self.__dict__.update(state)
+        self.processing_lock = Lock()
+
+# Processor shared by the tasks of a worker process
+_worker_processor = None
+
+def _init_worker(processor, queue):
+    """Install the processor and log queue for a worker process."""
+    global _worker_processor
+    _worker_processor = processor
+    if queue is not None:
+        root = logging.getLogger()
+        root.handlers[:] = [logging.handlers.QueueHandler(queue)]
+        root.setLevel(logging.INFO)
+
+def _process_file_in_worker(file_path):
+    """Process a single file in a worker process."""
+    _worker_processor.process_file(file_path)
 
 class FileWatcher(FileSystemEventHandler):
-    """Handles file system events for the INPUT directory."""
+    """Handles file system events for the INPUT directory.
+    
+    Events are coalesced per path and the file is processed once the path
+    has been quiet for the debounce interval, so bursts and duplicate
+    events only trigger one run per file. A close-after-write event marks
+    the file as finished straight away.
+    """
     
-    def __init__(self, processor):
+    def __init__(self, processor, debounce_seconds=1.0):
         self.processor = processor
+        # Close events aren't guaranteed (polling observers, network
+        # mounts), so without one a quiet period marks a copy as finished.
+        # It only applies then, and has to outlast a stalled writer, which
+        # a few hundred milliseconds often doesn't
+        self.debounce_seconds = debounce_seconds
+        self.pending = {}  # path -> time of its latest event
+        self.pending_lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+        self.stopped = Event()
+        self.flusher = Thread(target=self.flush_pending, daemon=True)
+        self.flusher.start()
         super().__init__()
     
+    def schedule(self, path):
+        """Queue a path, restarting its debounce interval unless it is due."""
+        now = time.monotonic()
+        with self.pending_lock:
+            # A file marked finished by its close event stays due; copies
+            # often set its mode or times just after closing it
+            if self.pending.get(path, now) > now - self.debounce_seconds:
+                self.pending[path] = now
+    
+    def flush_pending(self):
+        """Hand paths that have settled to the executor."""
+        while not self.stopped.wait(0.1):
+            cutoff = time.monotonic() - self.debounce_seconds
+            with self.pending_lock:
+                ready = [path for path, seen in self.pending.items() if seen <= cutoff]
+                for path in ready:
+                    del self.pending[path]
+            for path in ready:
+                future = self.executor.submit(self.processor.process_file, path)
+                future.add_done_callback(functools.partial(self.report_failure, path))
+    
+    @staticmethod
+    def report_failure(path, future):
+        """Log an error that escaped process_file; nobody else reads the future."""
+        error = future.exception()
+        if error is not None:
+            logger.error("Failed to process file %s: %s", path, error)
+    
+    def stop(self):
+        """Stop dispatching and wait for files already being processed."""
+        self.stopped.set()
+        self.flusher.join()
+        self.executor.shutdown()
+    
     def on_created(self, event):
         """Handle file creation events."""
+        # Files moved or hard-linked into the folder only report a creation
+        if not event.is_directory:
+            self.schedule(event.src_path)
+    
+    def on_modified(self, event):
+        """Handle writes to a file still being copied in."""
+        # Keep pushing the file back until the writes stop
+        if not event.is_directory:
+            self.schedule(event.src_path)
+    
+    def on_closed(self, event):
+        """Handle files closed after writing (inotify only)."""
         if not event.is_directory:
-            # Wait a moment for file to be fully written
-            time.sleep(1)
-            self.processor.process_file(event.src_path)
+            with self.pending_lock:
+                # The writer is done, so dispatch on the next flush instead
+                # of waiting out the quiet period
+                self.pending[event.src_path] = time.monotonic() - self.debounce_seconds
     
     def on_moved(self, event):
         """Handle file move events."""
         if not event.is_directory:
-            # Wait a moment for file to be fully written
-            time.sleep(1)
-            self.processor.process_file(event.dest_path)
+            with self.pending_lock:
+                # The old name no longer exists, e.g. a renamed temp file
+                self.pending.pop(event.src_path, None)
+            self.schedule(event.dest_path)
 
 def check_ffmpeg():
     """Check if FFmpeg is available for video processing."""
     try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+        subprocess.run(
+            [FFMPEG, '-version'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True
+        )
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
+def setup_logging():
+    """Route log records through a queue to a single listener thread."""
+    global log_queue
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = [
+        logging.FileHandler('watermark_app.log', delay=True),
+        logging.StreamHandler(sys.stdout)
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    # Logging calls only enqueue the record; the listener does the writing,
+    # so workers and watcher threads don't contend for the file
+    log_queue = multiprocessing.Queue()
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+
 def main():
     """Main application entry point."""
+    setup_logging()
+    
     print("=== Watermark Application ===")
     print("Automatically adds watermarks to photos and videos")
     print("Place files in the INPUT folder to process them")
     print("Press Ctrl+C to stop\n")
     
+    # Pillow-SIMD reports the same package name, so log the version to
+    # confirm which build is doing the image compositing
+    logger.info("Using Pillow %s", PIL.__version__)
+    if not features.check_feature('libjpeg_turbo'):
+        logger.warning("Pillow is not built with libjpeg-turbo; JPEG encoding will be slower.")
+    
     # Check if FFmpeg is available
     if not check_ffmpeg():
         logger.warning("FFmpeg not found. Video processing will not be available.")
@@ -400,10 +793,11 @@ def main():
             observer.stop()
         
         observer.join()
+        event_handler.stop()
         logger.info("Application stopped.")
         
     except Exception as e:
-        logger.error(f"Application error: {e}")
+        logger.error("Application error: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":